@@ -0,0 +1,61 @@
+"""Memory, snapshot and diff cost of the fleet state table
+
+    python benchmarks/bench_state_table.py --boards 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state_table import StateTable
+
+
+def best_of(fn, rounds):
+    """Return the fastest of several timed calls, in microseconds"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boards", type=int, default=100000)
+    parser.add_argument("--changes", type=int, default=100, help="pins toggled between snapshot and diff")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    table = StateTable()
+    for board in range(args.boards):
+        table.update(f"board{board}", {5: 0, 6: 1, 7: 0, 8: 0})
+
+    pins = args.boards * table.slots
+    memory = len(table.view()) * 2  # states plus the "known" mask
+    snapshot = table.snapshot()
+
+    for _ in range(args.changes):
+        board = f"board{random.randrange(args.boards)}"
+        pin = random.choice((5, 6, 7, 8))
+        table.set(board, pin, 1 - table.get(board, pin))
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        table.get("board0", 6)
+    get_us = (time.perf_counter() - start) / 1000 * 1e6
+
+    print(f"boards            {args.boards}")
+    print(f"pin slots         {pins}")
+    print(f"memory            {memory / 1e6:.2f} MB")
+    print(f"get               {get_us:.2f} us")
+    print(f"snapshot          {best_of(table.snapshot, args.rounds):.0f} us")
+    print(f"diff ({args.changes} changes) {best_of(lambda: table.diff(snapshot), args.rounds):.0f} us")
+    print(f"zero-copy view    {best_of(table.view, args.rounds):.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Parse cost and size of text vs binary status frames
+
+    python benchmarks/bench_status.py --pins 4
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import decode_status, encode_status
+
+
+def text_frame(states):
+    """The "5:0,6:1,7:0,8:0" frame the firmware sends without binary status"""
+    return ",".join(f"{pin}:{state}" for pin, state in states.items())
+
+
+def per_frame_ns(frames, pins, rounds):
+    """Return the best mean decode time per frame, in nanoseconds"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for frame in frames:
+            decode_status(frame, pins)
+        best = min(best, time.perf_counter() - start)
+    return best / len(frames) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pins", type=int, default=4, help="pins per board (ESP32 firmware uses 4)")
+    parser.add_argument("--frames", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    pins = list(range(5, 5 + args.pins))
+    updates = [{pin: random.randint(0, 1) for pin in pins} for _ in range(args.frames)]
+    text = [text_frame(states) for states in updates]
+    binary = [encode_status(states, pins, seq & 0xFFFF) for seq, states in enumerate(updates)]
+
+    for states, t, b in zip(updates[:100], text, binary):
+        assert decode_status(t)[0] == decode_status(b, pins)[0] == states
+
+    print(f"{'format':<8}{'bytes/update':>14}{'ns/frame':>12}")
+    for name, frames in (("text", text), ("binary", binary)):
+        size = sum(len(frame) for frame in frames) / len(frames)
+        print(f"{name:<8}{size:>14.1f}{per_frame_ns(frames, pins, args.rounds):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
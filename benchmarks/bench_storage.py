@@ -0,0 +1,114 @@
+"""Latency of the login and devices lookups for each storage backend
+
+    python benchmarks/bench_storage.py                                   # SQLite only
+    python benchmarks/bench_storage.py --mysql root:password@localhost/iotify
+
+With --mysql both backends are timed on the same real users: a sample of
+usernames is read from MySQL and those users and their devices are copied
+into the SQLite file (padded with synthetic users up to --users), so every
+lookup on either side is a hit.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import MySQLStorage, SQLiteStorage
+
+
+def time_lookups(storage, usernames, rounds):
+    """Return (login_us, devices_us) mean microseconds per lookup"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for username in usernames:
+            storage.get_password(username)
+    login = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for username in usernames:
+            storage.get_devices(username)
+    devices = time.perf_counter() - start
+
+    lookups = rounds * len(usernames)
+    return login / lookups * 1e6, devices / lookups * 1e6
+
+
+def seed_sqlite(storage, users, devices_per_user, existing=()):
+    """Fill a SQLite store with synthetic users and devices, skipping names already taken"""
+    for u in range(users):
+        username = f"user{u}"
+        if username in existing:
+            continue
+        storage.add_user(username, "secret")
+        for d in range(devices_per_user):
+            storage.add_device(username, f"Device {d}", f"dev{u}_{d}", 5 + d % 4)
+
+
+def mysql_sample(mysql, limit):
+    """Return up to limit real usernames from a MySQL database"""
+    cursor = mysql.con.cursor()
+    try:
+        cursor.execute("SELECT username FROM login LIMIT %s", (limit,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def copy_users(source, target, usernames):
+    """Copy users and their device rows from one store into a SQLite store"""
+    for username in usernames:
+        target.add_user(username, source.get_password(username))
+        for device in source.get_devices(username):
+            # name, id, pin, state and the optional board column
+            target.add_device(username, *device[1:6])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--devices", type=int, default=4, help="devices per user")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--mysql", metavar="USER:PASSWORD@HOST/DATABASE",
+                        help="also benchmark an existing MySQL database")
+    args = parser.parse_args()
+
+    sample = [f"user{u}" for u in range(0, args.users, max(1, args.users // 200))]
+    mysql = None
+
+    if args.mysql:
+        credentials, _, location = args.mysql.rpartition("@")
+        user, _, password = credentials.partition(":")
+        host, _, database = location.partition("/")
+        mysql = MySQLStorage(host=host, user=user, password=password, database=database,
+                             auth_plugin='mysql_native_password')
+        if not mysql.connect():
+            sys.exit("Could not connect to MySQL")
+        sample = mysql_sample(mysql, len(sample))
+        if not sample:
+            sys.exit("The MySQL login table is empty; nothing to compare")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = SQLiteStorage(os.path.join(tmp, "bench.db"))
+        sqlite.connect()
+        if mysql:
+            copy_users(mysql, sqlite, sample)
+        seed_sqlite(sqlite, args.users - len(sample) if mysql else args.users, args.devices, set(sample))
+        results.append(("sqlite", *time_lookups(sqlite, sample, args.rounds)))
+        sqlite.close()
+
+    if mysql:
+        results.append(("mysql", *time_lookups(mysql, sample, args.rounds)))
+        mysql.close()
+
+    print(f"{'backend':<10}{'login (us)':>14}{'devices (us)':>16}")
+    for backend, login, devices in results:
+        print(f"{backend:<10}{login:>14.1f}{devices:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,58 @@ import asyncio
 import websockets
 import threading
 import json
+import os
+import hashlib
+
+from protocol import attach_trace, join_board
+from tracing import SpanRecorder, new_trace_id
 
 CLOUD_SERVER_URL = "ws://192.168.176.53:8765"  # Change this to your cloud server IP
 
+# Last device list of each user, shown instantly on the next launch
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".iotify", "cache")
+
+# Spans of sampled control commands
+tracer = SpanRecorder("client")
+
+class DeviceCache:
+    """On-disk cache of each user's last device list and states"""
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, username):
+        name = hashlib.sha256(username.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}.json")
+
+    def load(self, username):
+        """Return the cached device rows of a user, or None"""
+        try:
+            with open(self._path(username)) as f:
+                cached = json.load(f)
+            if cached.get("username") == username:
+                return cached["devices"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def save(self, username, devices):
+        """Store the device rows of a user, replacing the file atomically"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(username)
+            with open(path + ".tmp", "w") as f:
+                json.dump({"username": username, "devices": devices}, f)
+            os.replace(path + ".tmp", path)
+        except (OSError, TypeError) as e:
+            print(f"Device cache write failed: {e}")
+
 class WebSocketClient:
     def __init__(self):
         self.websocket = None
         self.connected = False
+        # One request/response exchange at a time; replies carry no request id
+        self._lock = asyncio.Lock()
 
     async def connect(self):
         """Connect to cloud server"""
@@ -47,6 +92,15 @@ class WebSocketClient:
                 return None
         return None
 
+    async def request(self, message, on_sent=None):
+        """Send a message and wait for its reply"""
+        async with self._lock:
+            if await self.send_message(message):
+                if on_sent:
+                    on_sent()
+                return await self.receive_message()
+            return None
+
     async def close(self):
         """Close connection"""
         if self.websocket:
@@ -62,6 +116,7 @@ class App(ctk.CTk):
 
         # Initialize WebSocket client
         self.ws_client = WebSocketClient()
+        self.device_cache = DeviceCache()
         self.current_user = None
         
         # Create event loop for async operations
@@ -203,11 +258,7 @@ class LoginPage(ctk.CTkFrame):
     async def _send_login_request(self, login_data):
         """Send login request to server and get response"""
         try:
-            success = await self.controller.ws_client.send_message(login_data)
-            if success:
-                response = await self.controller.ws_client.receive_message()
-                return response
-            return None
+            return await self.controller.ws_client.request(login_data)
         except Exception as e:
             print(f"Login request error: {e}")
             return None
@@ -265,15 +316,23 @@ class DevicesPage(ctk.CTkFrame):
         
         self.device_states = {}
         self.devices_data = []
+        self._shown_user = None
 
     def on_show(self):
-        # Clear old widgets
-        for widget in self.device_list_frame.winfo_children():
-            widget.destroy()
-        self.device_states = {}
-        
-        # Load devices from server
-        self._show_message("Loading devices...")
+        user = self.controller.current_user
+
+        # Render the last known devices straight away, then revalidate in the background
+        if user and user != self._shown_user:
+            self.device_states = {}
+            self.devices_data = []
+            cached = self.controller.device_cache.load(user)
+            if cached:
+                self.devices_data = cached
+                self._display_devices(cached)
+            else:
+                self._show_message("Loading devices...")
+            self._shown_user = user
+
         self.load_devices()
 
     def load_devices(self):
@@ -282,44 +341,74 @@ class DevicesPage(ctk.CTkFrame):
             self._show_message("Error: No user logged in")
             return
 
-        devices_request = {"action": "devices", "username": self.controller.current_user}
+        username = self.controller.current_user
+        devices_request = {"action": "devices", "username": username}
         future = self.controller.schedule_async(self._request_devices(devices_request))
-        self.after(100, lambda: self._check_devices_response(future))
+        self.after(100, lambda: self._check_devices_response(future, username))
 
     async def _request_devices(self, devices_request):
         """Request devices from server"""
         try:
-            success = await self.controller.ws_client.send_message(devices_request)
-            if success:
-                response = await self.controller.ws_client.receive_message()
-                return response
-            return None
+            return await self.controller.ws_client.request(devices_request)
         except Exception as e:
             print(f"Devices request error: {e}")
             return None
 
-    def _check_devices_response(self, future):
+    def _check_devices_response(self, future, username):
         """Check devices response and update UI"""
         if future.done():
+            if username != self.controller.current_user:
+                # Logged out (or another user logged in) while the request was in flight
+                print(f"Dropping devices reply for {username}")
+                return
             try:
                 response = future.result()
                 if response:
                     devices_data = eval(response)  # Parse the response
                     if isinstance(devices_data, list) and devices_data:
                         if devices_data[0] == 'ESP8266 Disconnected':
-                            self._show_message("ESP8266 Device Disconnected")
+                            self._show_stale_or_message("ESP8266 Device Disconnected")
+                        elif not all(isinstance(device, list) for device in devices_data):
+                            # Server-side errors arrive as ['Database Error'] and the like
+                            self._show_stale_or_message(str(devices_data[0]))
                         else:
-                            self.devices_data = devices_data
-                            self._display_devices(devices_data)
+                            self._apply_devices(devices_data, username)
                     else:
+                        if devices_data == []:
+                            self.devices_data = []
+                            self.controller.device_cache.save(username, [])
                         self._show_message("No devices found")
                 else:
-                    self._show_message("Server connection lost")
+                    self._show_stale_or_message("Server connection lost")
             except Exception as e:
                 print(f"Devices response error: {e}")
-                self._show_message("Error loading devices")
+                self._show_stale_or_message("Error loading devices")
+        else:
+            self.after(100, lambda: self._check_devices_response(future, username))
+
+    def _apply_devices(self, devices_data, username):
+        """Bring the page up to date with a fresh device list, touching only what changed"""
+        def layout(devices):
+            return [tuple(device[1:4]) + tuple(device[6:7]) for device in devices]
+
+        if self.device_states and layout(devices_data) == layout(self.devices_data):
+            for device_info in devices_data:
+                state = 'On' if device_info[4] == '1' else 'Off'
+                state_var = self.device_states.get(device_info[2])
+                if state_var is not None and state_var.get() != state:
+                    state_var.set(state)
+        else:
+            self._display_devices(devices_data)
+
+        self.devices_data = devices_data
+        self.controller.device_cache.save(username, devices_data)
+
+    def _show_stale_or_message(self, msg):
+        """Keep showing cached devices if there are any, otherwise show the message"""
+        if self.device_states:
+            print(f"Keeping cached devices: {msg}")
         else:
-            self.after(100, lambda: self._check_devices_response(future))
+            self._show_message(msg)
 
     def _display_devices(self, devices_data):
         """Display devices in the UI"""
@@ -328,13 +417,14 @@ class DevicesPage(ctk.CTkFrame):
             widget.destroy()
 
         for device_info in devices_data:
-            # device_info format: [userid, device_name, device_id, pin_number, state]
+            # device_info format: [userid, device_name, device_id, pin_number, state, updated_at, board]
             if len(device_info) >= 5:
                 userid, device_name, device_id, pin_number, state = device_info[:5]
                 self._add_device_row({
                     'name': device_name,
                     'id': device_id,
                     'pin': pin_number,
+                    'board': device_info[6] if len(device_info) > 6 else None,
                     'state': 'On' if state == '1' else 'Off'
                 })
 
@@ -371,44 +461,75 @@ class DevicesPage(ctk.CTkFrame):
 
         print(f"Controlling device: {device_id}, pin: {pin}, state: {state}")
 
-        # Send control command to server (format: "pin,state")
-        control_message = f"{pin},{state_value}"
-        future = self.controller.schedule_async(self._send_control_command(control_message))
-        self.after(100, lambda: self._check_control_response(future, device_id, state))
+        # Sampled commands carry a trace id so the toggle can be followed end to end
+        trace_id = new_trace_id()
+        tracer.record(trace_id, "client.clicked", pin=pin, state=state_value)
 
-    async def _send_control_command(self, control_message):
+        # Send control command to server (format: "[board|]pin,state")
+        control_message = join_board(device.get('board'), attach_trace(f"{pin},{state_value}", trace_id))
+        future = self.controller.schedule_async(self._send_control_command(control_message, trace_id))
+        self.after(100, lambda: self._check_control_response(future, device_id, state, trace_id))
+
+    async def _send_control_command(self, control_message, trace_id=None):
         """Send control command to server"""
         try:
-            success = await self.controller.ws_client.send_message(control_message)
-            if success:
-                response = await self.controller.ws_client.receive_message()
-                return response
-            return None
+            response = await self.controller.ws_client.request(
+                control_message, on_sent=lambda: tracer.record(trace_id, "client.sent")
+            )
+            tracer.record(trace_id, "client.response")
+            return response
         except Exception as e:
             print(f"Control command error: {e}")
             return None
 
-    def _check_control_response(self, future, device_id, state):
+    def _check_control_response(self, future, device_id, state, trace_id=None):
         """Check control response"""
         if future.done():
+            tracer.record(trace_id, "client.ui_updated")
             try:
                 response = future.result()
                 if response:
                     print(f"Control response: {response}")
-                    # Update UI state
-                    if device_id in self.device_states:
-                        self.device_states[device_id].set(state)
+                    response_data = eval(response)  # Parse the response
+                    if not isinstance(response_data, dict) or response_data.get('action') != 'control':
+                        # e.g. {'error': ...}: the toggle never reached the board
+                        print(f"Control command rejected: {response}")
+                    elif response_data.get('status') == 'successful':
+                        # Update UI state
+                        if device_id in self.device_states:
+                            self.device_states[device_id].set(state)
+                        self._cache_state(device_id, state)
+                    else:
+                        # The radio button already moved; put it back to the last known state
+                        self._revert_state(device_id)
                 else:
                     print("No response from server for control command")
             except Exception as e:
                 print(f"Control response error: {e}")
         else:
-            self.after(100, lambda: self._check_control_response(future, device_id, state))
+            self.after(100, lambda: self._check_control_response(future, device_id, state, trace_id))
+
+    def _cache_state(self, device_id, state):
+        """Record a confirmed toggle in the cached device list"""
+        for device_info in self.devices_data:
+            if len(device_info) >= 5 and device_info[2] == device_id:
+                device_info[4] = '1' if state == 'On' else '0'
+                self.controller.device_cache.save(self.controller.current_user, self.devices_data)
+                return
+
+    def _revert_state(self, device_id):
+        """Show the cached state of a device again after a failed toggle"""
+        for device_info in self.devices_data:
+            if len(device_info) >= 5 and device_info[2] == device_id:
+                if device_id in self.device_states:
+                    self.device_states[device_id].set('On' if device_info[4] == '1' else 'Off')
+                return
 
     def _show_message(self, msg):
         # Remove old widgets
         for widget in self.device_list_frame.winfo_children():
             widget.destroy()
+        self.device_states = {}
         ctk.CTkLabel(self.device_list_frame, text=msg, font=("Oswald", 18)).pack(pady=12)
 
     def logout(self):
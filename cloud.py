@@ -1,55 +1,217 @@
 import asyncio
 import websockets
-import mysql.connector as ms
 import logging
 import json
+import os
+import time
+
+from protocol import (
+    split_board, join_board, split_trace, attach_trace,
+    FORMAT_OFFER, FORMAT_REPLY_PREFIX, parse_format_reply, decode_status, is_newer
+)
+from state_table import StateTable
+from storage import create_storage
+from tracing import SpanRecorder
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Database connection
-try:
-    con = ms.connect(
-        host="localhost", 
-        user="root", 
-        password="yatin_ysp_207619", 
-        database='iotify',
-        auth_plugin='mysql_native_password'
-    )
-    sql = con.cursor(buffered=True)
-    logger.info("Database connected successfully")
-except Exception as e:
-    logger.error(f"Database connection failed: {e}")
-    sql = None
+# Database configuration: "mysql" or "sqlite" (embedded, for single-node deployments)
+STORAGE_BACKEND = os.environ.get("IOTIFY_STORAGE", "mysql")
+STORAGE_CONFIG = {
+    "mysql": {
+        "host": "localhost",
+        "user": "root",
+        "password": "yatin_ysp_207619",
+        "database": 'iotify',
+        "auth_plugin": 'mysql_native_password'
+    },
+    "sqlite": {
+        "path": os.environ.get("IOTIFY_SQLITE_PATH", "iotify.db")
+    },
+}
+
+# Database connection (retried on demand if the database is down at startup)
+storage = create_storage(STORAGE_BACKEND, **STORAGE_CONFIG[STORAGE_BACKEND])
+storage.connect()
+
+# Spans of sampled control commands
+tracer = SpanRecorder("cloud")
+
+# Background status polling: fast right after a command, slow when idle, and
+# skipped altogether while the board keeps sending frames on its own
+FAST_POLL_INTERVAL = 0.5   # Seconds between polls shortly after a command
+IDLE_POLL_INTERVAL = 15.0  # Seconds between polls otherwise (ESP32 pushes status every 10 s)
+ACTIVE_WINDOW = 5.0        # Seconds after a command during which polling stays fast
+POLL_TIMEOUT = 3.0         # Seconds to wait for a poll reply before asking again (ard.ino takes ~1 s)
 
 class ESPController:
     """Real ESP32 controller using WebSocket communication"""
     
     def __init__(self):
-        self.esp_websocket = None
-        self.connected = False
-        self.device_states = {
-            "5": "0", "6": "0", "7": "0", "8": "0"  # Default states
-        }
+        # Hardware connections (ESP32s and serial gateways) and the boards each one serves
+        self.connections = {}
+        # Board -> websocket it is reached through (board None is the directly connected
+        # ESP32, claimed by its first unaddressed frame; gateways always address their boards)
+        self.routes = {}
+        # Pin states of every board as last reported by the board itself
+        self.states = StateTable()
+        # Board -> {pin: state} commanded but not yet acknowledged or reported
+        self.pending = {}
+        # Per-board bookkeeping (board None is the directly connected one)
+        self.updated_at = {}     # Wall-clock time of the last status frame
+        self.last_frame = {}     # Monotonic time of the last frame of any kind
+        self.last_command = {}   # Monotonic time of the last command sent
+        self.status_pins = {}    # Pin order of boards that negotiated binary status
+        self.status_seq = {}     # Last binary status sequence number
+        self.poll_sent = {}      # Monotonic time of a status poll not answered yet
+        self._pollers = {}
+        self._wake = {}
         logger.info("ESP Controller initialized")
 
+    @property
+    def connected(self):
+        """Whether any hardware connection is up"""
+        return bool(self.connections)
+
     async def set_esp_connection(self, websocket):
-        """Set the ESP32 WebSocket connection"""
-        self.esp_websocket = websocket
-        self.connected = True
+        """Register a new ESP32 (or gateway) WebSocket connection"""
+        # Boards are claimed by their first frame (see note_frame), so a gateway
+        # never ends up sharing the unaddressed board with an ESP32
+        self.connections[websocket] = set()
         logger.info("ESP32 connected to cloud server")
 
-    async def disconnect_esp(self):
-        """Handle ESP32 disconnection"""
-        self.esp_websocket = None
-        self.connected = False
+        # Offer compact binary status frames; older firmware just ignores this
+        try:
+            await websocket.send(FORMAT_OFFER)
+        except Exception as e:
+            logger.error(f"Status format offer failed: {e}")
+
+    async def disconnect_esp(self, websocket):
+        """Handle disconnection of one ESP32 (or gateway), leaving the others alone"""
+        boards = self.connections.pop(websocket, None)
+        if boards is None:
+            return
+
+        for board in boards:
+            if self.routes.get(board) is not websocket:
+                continue
+            # Another live connection serving the same board takes over, if any
+            fallback = next((ws for ws, served in self.connections.items() if board in served), None)
+            if fallback is not None:
+                self.routes[board] = fallback
+                continue
+
+            del self.routes[board]
+            self.pending.pop(board, None)
+            poller = self._pollers.pop(board, None)
+            if poller:
+                poller.cancel()
+            self._wake.pop(board, None)
+            self.poll_sent.pop(board, None)
+            # Formats are renegotiated on every connection
+            self.status_pins.pop(board, None)
+            self.status_seq.pop(board, None)
         logger.warning("ESP32 disconnected from cloud server")
 
-    async def send_command(self, pin, state):
-        """Send command to ESP32"""
+    def claim_board(self, websocket, board):
+        """Record that a board is served by a connection; the first live claimant routes it"""
+        served = self.connections.get(websocket)
+        if served is None:
+            return
+        served.add(board)
+        self.routes.setdefault(board, websocket)
+        self.start_poller(board)
+
+    def start_poller(self, board):
+        """Start the background status poller of a board if it is not running"""
+        if board in self._pollers or board not in self.routes:
+            return
+        self._wake[board] = asyncio.Event()
+        self._pollers[board] = asyncio.create_task(self._poll_status(board))
+
+    def note_frame(self, board, websocket=None):
+        """Record that a board just sent something, which postpones its next poll"""
+        self.last_frame[board] = time.monotonic()
+        if self.poll_sent.pop(board, None) is not None and board in self._wake:
+            # The board answered; the next poll may go out on the normal schedule
+            self._wake[board].set()
+        if websocket is not None:
+            self.claim_board(websocket, board)
+
+    def update_states(self, board, states):
+        """Store a status report ({pin: state} ints) of a board in the cache"""
+        # Check every pin first so a bad pair cannot leave the report half-applied
+        invalid = [pin for pin in states if not 0 <= pin < self.states.slots]
+        if invalid:
+            logger.warning(f"Ignoring pins {invalid} outside the {self.states.slots} slots of board {board or 'ESP32'}")
+            states = {pin: state for pin, state in states.items() if pin not in invalid}
+        self.states.update(board, states)
+        self.updated_at[board] = time.time()
+        # A full report supersedes whatever was still in flight
+        self.pending.pop(board, None)
+
+    def confirm_command(self, board, ack):
+        """Apply an "ack:pin,state" from a board: the pin now holds the acknowledged state"""
+        pin_str, _, state_str = ack[len("ack:"):].partition(",")
+        pin, state = int(pin_str), int(state_str)
+        self.pending.get(board, {}).pop(pin, None)
+        if 0 <= pin < self.states.slots:
+            self.states.set(board, pin, state)
+
+    def apply_status(self, board, frame):
+        """Decode a text or binary status frame and store it, dropping stale binary frames"""
+        states, seq = decode_status(frame, self.status_pins.get(board))
+        if seq is not None:
+            last = self.status_seq.get(board)
+            if last is not None and not is_newer(seq, last):
+                logger.info(f"Dropped stale status frame {seq} (last {last})")
+                return None
+            self.status_seq[board] = seq
+        self.update_states(board, states)
+        return states
+
+    async def _poll_status(self, board):
+        """Ask a board for its status whenever it has been quiet for a poll interval"""
+        wake = self._wake[board]
         try:
-            if not self.connected or not self.esp_websocket:
+            while board in self.routes:
+                now = time.monotonic()
+                if self.pending.get(board) or now - self.last_command.get(board, float("-inf")) < ACTIVE_WINDOW:
+                    interval = FAST_POLL_INTERVAL
+                else:
+                    interval = IDLE_POLL_INTERVAL
+
+                due = self.last_frame.get(board, float("-inf")) + interval
+                if board in self.poll_sent:
+                    # One poll outstanding at most: extra ones would queue up on the
+                    # board's serial link ahead of real commands
+                    due = max(due, self.poll_sent[board] + POLL_TIMEOUT)
+                if now >= due:
+                    # The reply arrives through handle_esp32 like any other status frame
+                    await self.routes[board].send(join_board(board, "status"))
+                    self.poll_sent[board] = now
+                    due = now + max(interval, POLL_TIMEOUT)
+
+                # A command (or the reply to a poll) wakes us early to reschedule
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=due - now)
+                except asyncio.TimeoutError:
+                    pass
+        except Exception as e:
+            logger.error(f"Status poller error for board {board or 'ESP32'}: {e}")
+        finally:
+            if self._pollers.get(board) is asyncio.current_task():
+                del self._pollers[board]
+                self._wake.pop(board, None)
+
+    async def send_command(self, pin, state, board=None, trace_id=None):
+        """Send command to ESP32, or to a board behind a serial gateway"""
+        websocket = self.routes.get(board)
+        try:
+            if websocket is None:
                 #logger.error("ESP32 not connected")
                 return False
 
@@ -58,58 +220,34 @@ class ESPController:
             
             # Send command in format "pin,state"
             command = f"{pin_str},{state_str}"
-            await self.esp_websocket.send(command)
+            await websocket.send(join_board(board, attach_trace(command, trace_id)))
+            tracer.record(trace_id, "cloud.esp_sent", pin=pin, state=state)
             
-            # Update local state
-            self.device_states[pin_str] = state_str
+            # The cache only changes once the board acks or reports the new state
+            self.pending.setdefault(board, {})[pin] = state
+            self.last_command[board] = time.monotonic()
+            if board in self._wake:
+                self._wake[board].set()
+            else:
+                self.start_poller(board)
             logger.info(f"Sent to ESP32: Pin {pin} set to {state}")
             return True
             
         except websockets.ConnectionClosedError:
             logger.error("ESP32 connection lost during command")
-            await self.disconnect_esp()
+            await self.disconnect_esp(websocket)
             return False
         except Exception as e:
             logger.error(f"ESP command error: {e}")
             return False
 
-    async def get_device_states(self):
-        """Get current state of all devices"""
-        try:
-            if not self.connected or not self.esp_websocket:
-                logger.warning("ESP32 not connected, returning last known states")
-                return None
+    def get_device_states(self, board=None):
+        """Return (states, updated_at) from the cache without touching the board
 
-            # Request status from ESP32
-            await self.esp_websocket.send("status")
-            
-            # Wait for response (with timeout)
-            try:
-                response = await asyncio.wait_for(self.esp_websocket.recv(), timeout=5.0)
-                # Parse response format: "5:0,6:1,7:0,8:0"
-                if ':' in response:
-                    states = {}
-                    pairs = response.split(',')
-                    for pair in pairs:
-                        if ':' in pair:
-                            pin, state = pair.split(':')
-                            states[pin.strip()] = state.strip()
-                    
-                    self.device_states.update(states)
-                    logger.info(f"Received ESP32 states: {self.device_states}")
-                    
-            except asyncio.TimeoutError:
-                logger.warning("Timeout waiting for ESP32 status")
-            
-            return self.device_states.copy()
-            
-        except websockets.ConnectionClosedError:
-            logger.error("ESP32 connection lost during status request")
-            await self.disconnect_esp()
-            return None
-        except Exception as e:
-            logger.error(f"ESP states error: {e}")
-            return None
+        updated_at is the wall-clock time of the last status report, or None
+        if the board has not reported since the server started.
+        """
+        return self.states.board_states(board), self.updated_at.get(board)
 
 # Initialize ESP controller
 esp_controller = ESPController()
@@ -154,16 +292,19 @@ async def handle_esp32(websocket):
     except Exception as e:
         logger.error(f"Error handling ESP32 {esp_address}: {e}")
     finally:
-        await esp_controller.disconnect_esp()
+        await esp_controller.disconnect_esp(websocket)
         logger.info(f"ESP32 {esp_address} handler finished")
 
 async def process_client_message(websocket, message):
     """Process incoming messages from clients"""
     try:
-        # Check if message is a device control command (format: "pin,state")
-        if isinstance(message, str) and ',' in message and message.replace(',', '').replace('-', '').isdigit():
-            await handle_device_control(websocket, message)
-            return
+        # Check if message is a device control command (format: "[board|]pin,state[@trace]")
+        if isinstance(message, str):
+            board, command = split_board(message)
+            command, trace_id = split_trace(command)
+            if ',' in command and command.replace(',', '').replace('-', '').isdigit():
+                await handle_device_control(websocket, command, trace_id, board)
+                return
 
         # Try to parse as dictionary (login, devices requests)
         try:
@@ -195,50 +336,68 @@ async def process_esp32_message(websocket, message):
     """Process incoming messages from ESP32"""
     try:
         logger.info(f"ESP32 message: {message}")
+
+        if isinstance(message, bytes):
+            # Binary status frame from a board that negotiated it (never behind a gateway)
+            esp_controller.note_frame(None, websocket)
+            states = esp_controller.apply_status(None, message)
+            logger.info(f"Updated device states: {states}")
+            return
+
+        # Frames from boards behind a serial gateway are prefixed with the board id
+        board, message = split_board(message)
+        esp_controller.note_frame(board, websocket)
         
+        if message.startswith("ack:"):
+            # Acknowledgment from ESP32, echoing the trace id of sampled commands
+            ack, trace_id = split_trace(message)
+            tracer.record(trace_id, "cloud.ack", board=board)
+            esp_controller.confirm_command(board, ack)
+            logger.info(f"ESP32 acknowledged: {ack}")
+
+        elif message.startswith("error"):
+            logger.warning(f"ESP32 error: {message}")
+
+        elif message.startswith(FORMAT_REPLY_PREFIX):
+            # Board accepted binary status frames; bits follow this pin order
+            esp_controller.status_pins[board] = parse_format_reply(message)
+            esp_controller.status_seq.pop(board, None)
+            logger.info(f"Binary status enabled, pins: {esp_controller.status_pins[board]}")
+
         # Handle status updates from ESP32
-        if ':' in message:
+        elif ':' in message:
             # Status update format: "5:0,6:1,7:0,8:0"
-            states = {}
-            pairs = message.split(',')
-            for pair in pairs:
-                if ':' in pair:
-                    pin, state = pair.split(':')
-                    states[pin.strip()] = state.strip()
-            
-            esp_controller.device_states.update(states)
+            states = esp_controller.apply_status(board, message)
             logger.info(f"Updated device states: {states}")
             
-        elif message.startswith("ack:"):
-            # Acknowledgment from ESP32
-            logger.info(f"ESP32 acknowledged: {message}")
-            
         else:
             logger.info(f"ESP32 info: {message}")
             
     except Exception as e:
         logger.error(f"Error processing ESP32 message: {e}")
 
-async def handle_device_control(websocket, message):
+async def handle_device_control(websocket, message, trace_id=None, board=None):
     """Handle device control commands from clients (format: "pin,state")"""
     try:
+        tracer.record(trace_id, "cloud.received")
         pin_str, state_str = message.split(',')
         pin = int(pin_str)
         state = int(state_str)
         
-        logger.info(f"Client device control: pin={pin}, state={state}")
+        logger.info(f"Client device control: board={board}, pin={pin}, state={state}")
 
-        # Send command to ESP32
-        success = await esp_controller.send_command(pin, state)
+        # Send command to ESP32 (or the addressed board behind a gateway)
+        success = await esp_controller.send_command(pin, state, board=board, trace_id=trace_id)
         
         if success:
-            response = f"'{{'action': 'control', 'status': 'failed', 'pin': {pin}, 'state': {state}}}'"
-            logger.info(f"Control failed: pin={pin}, state={state}")
+            response = f"{{'action': 'control', 'status': 'successful', 'pin': {pin}, 'state': {state}}}"
+            logger.info(f"Control successful: pin={pin}, state={state}")
         else:
-            response = f"'{{'action': 'control', 'status': 'successful', 'pin': {pin}, 'state': {state}}}'"
-            logger.error(f"Control successful: pin={pin}, state={state}")
+            response = f"{{'action': 'control', 'status': 'failed', 'pin': {pin}, 'state': {state}}}"
+            logger.error(f"Control failed: pin={pin}, state={state}")
 
         await websocket.send(response)
+        tracer.record(trace_id, "cloud.responded")
 
     except ValueError:
         logger.error(f"Invalid control command format: {message}")
@@ -259,7 +418,7 @@ async def handle_login(websocket, data):
         await websocket.send(response)
         return
 
-    if not sql:
+    if not storage.ensure_connected():
         logger.error("Database not available")
         response = "{'action': 'login', 'status': 'database_error'}"
         await websocket.send(response)
@@ -267,15 +426,12 @@ async def handle_login(websocket, data):
 
     try:
         # Query user from database
-        query = "SELECT * FROM login WHERE username=%s"
-        val = (username,)
-        sql.execute(query, val)
-        dat = sql.fetchone()
+        stored_password = storage.get_password(username)
 
-        if dat is None:
+        if stored_password is None:
             response = "{'action': 'login', 'status': 'not_found'}"
             logger.info(f"Login failed - user not found: {username}")
-        elif dat[2] == password:
+        elif stored_password == password:
             response = "{'action': 'login', 'status': 'affirmed'}"
             logger.info(f"Login successful: {username}")
         else:
@@ -298,17 +454,14 @@ async def handle_devices_request(websocket, data):
         await websocket.send("{'error': 'Username required'}")
         return
 
-    if not sql:
+    if not storage.ensure_connected():
         logger.error("Database not available")
         await websocket.send("['Database Disconnected']")
         return
 
     try:
         # Get user's devices from database
-        query = "SELECT * FROM devices WHERE userid=%s"
-        val = (username,)
-        sql.execute(query, val)
-        devices_data = sql.fetchall()
+        devices_data = storage.get_devices(username)
 
         if not devices_data:
             # Create some fake devices for testing if none exist in DB
@@ -319,15 +472,19 @@ async def handle_devices_request(websocket, data):
             ]
             devices_data = fake_devices
 
-        # Get current states from ESP32
-        
-        
-        
+        # Get current states from the status cache (never waits on the ESP32)
+        board_states = {}
+
+        # Row format: [userid, device_name, device_id, pin, state, updated_at, board]
         result_devices = []
         for device in devices_data:
-            device_copy = list(device)
-                          
-            result_devices.append(device_copy+['0',])
+            # An optional sixth column names the gateway board the device is wired to
+            board = device[5] if len(device) > 5 else None
+            if board not in board_states:
+                board_states[board] = esp_controller.get_device_states(board)
+            states, updated_at = board_states[board]
+            pin = str(device[3])
+            result_devices.append(list(device[:4]) + [states.get(pin, '0'), updated_at, board])
 
         await websocket.send(str(result_devices))
         logger.info(f"Sent devices for {username}: {len(result_devices)} devices")
@@ -30,6 +30,11 @@ const unsigned long WIFI_CHECK_INTERVAL = 30000; // 30 seconds
 bool wifiConnected = false;
 bool websocketConnected = false;
 
+// Compact binary status frames, enabled per connection when the cloud offers them
+const uint8_t STATUS_MAGIC = 0xB5;
+bool binaryStatus = false;
+uint16_t statusSeq = 0;
+
 void setup() {
     Serial.begin(115200);
     delay(1000);
@@ -121,6 +126,7 @@ void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
     switch(type) {
         case WStype_DISCONNECTED:
             websocketConnected = false;
+            binaryStatus = false;
             Serial.println("[WSc] Disconnected from cloud server");
             break;
 
@@ -169,6 +175,18 @@ void processCommand(String command) {
         // Cloud server requesting current status
         sendCurrentStatus();
     }
+    else if (command == "format:bin") {
+        // Cloud server offers binary status frames: accept and announce the bit order
+        String reply = "format:bin:";
+        for (int i = 0; i < NUM_PINS; i++) {
+            if (i > 0) reply += ",";
+            reply += String(PINS[i]);
+        }
+        webSocket.sendTXT(reply);
+
+        binaryStatus = true;
+        sendCurrentStatus();
+    }
     else if (command.indexOf(',') > 0) {
         // Device control command: "pin,state"
         int commaIndex = command.indexOf(',');
@@ -232,6 +250,24 @@ void sendCurrentStatus() {
         return;
     }
 
+    if (binaryStatus) {
+        // Binary frame: magic, sequence number (little-endian), one bit per pin
+        uint8_t frame[3 + (NUM_PINS + 7) / 8] = {0};
+        frame[0] = STATUS_MAGIC;
+        frame[1] = statusSeq & 0xFF;
+        frame[2] = statusSeq >> 8;
+        for (int i = 0; i < NUM_PINS; i++) {
+            if (digitalRead(PINS[i])) {
+                frame[3 + i / 8] |= 1 << (i % 8);
+            }
+        }
+        statusSeq++;
+
+        webSocket.sendBIN(frame, sizeof(frame));
+        Serial.printf("Sent binary status #%u\n", frame[1] | frame[2] << 8);
+        return;
+    }
+
     // Create status message in format: "5:0,6:1,7:0,8:0"
     String status = "";
 
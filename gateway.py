@@ -0,0 +1,360 @@
+import asyncio
+import websockets
+import argparse
+import logging
+import os
+import termios
+import tty
+
+from protocol import split_board, join_board, split_trace, attach_trace, FORMAT_OFFER
+from tracing import SpanRecorder
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Spans of sampled control commands
+tracer = SpanRecorder("gateway")
+
+CLOUD_HARDWARE_URL = "ws://192.168.176.53:8766"  # Change this to your cloud server IP
+
+BAUD_RATES = {
+    9600: termios.B9600,
+    19200: termios.B19200,
+    38400: termios.B38400,
+    57600: termios.B57600,
+    115200: termios.B115200,
+}
+
+READ_CHUNK = 4096        # Bytes read per readable event
+MAX_LINE = 256           # Longest line a board may send before we resync
+ACK_TIMEOUT = 2.0        # Seconds to wait for a board reply (readStringUntil waits 1 s)
+RECONNECT_DELAY = 5.0    # Seconds between upstream reconnect attempts
+REOPEN_DELAY = 1.0       # First delay before reopening a serial port that failed
+REOPEN_MAX_DELAY = 30.0  # Longest delay between serial reopen attempts
+OFFLINE_ERROR = "error:board offline"
+OUTBOX_SIZE = 1024       # Frames buffered for the cloud while it is unreachable
+
+
+def is_reply(command, line):
+    """Whether a board line answers the command; "status" gets a status line, "pin,state" its own ack"""
+    if line.startswith("error"):
+        return True
+    if command == "status":
+        return ":" in line and not line.startswith("ack:")
+    # A late ack of a command that already timed out must not complete the next one
+    return line == f"ack:{command}"
+
+
+class SerialBoard:
+    """One Arduino on a serial port, driven with non-blocking I/O on the event loop"""
+
+    def __init__(self, board_id, path, baud=9600, on_line=None):
+        self.board_id = board_id
+        self.path = path
+        self.baud = baud
+        self.on_line = on_line
+        self.fd = None
+        self.commands = asyncio.Queue()
+        self._status_queued = False
+        self._loop = None
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._writing = False
+        self._reply = None
+        self._pending = None
+        self._pending_trace = None
+        self._worker = None
+        self._reopen_task = None
+
+    @property
+    def online(self):
+        """Whether the port is open and can take commands"""
+        return self.fd is not None
+
+    def open(self):
+        """Open the port and start the command worker; a missing port is retried in the background"""
+        self._loop = asyncio.get_running_loop()
+        self._worker = asyncio.create_task(self._run_commands())
+        try:
+            self._open_port()
+        except (OSError, termios.error) as e:
+            logger.error(f"Board {self.board_id} unavailable: {e}")
+            self._port_lost()
+
+    def _open_port(self):
+        """Open the port in raw, non-blocking mode and start reading"""
+        fd = os.open(self.path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            tty.setraw(fd)
+            attrs = termios.tcgetattr(fd)
+            attrs[2] |= termios.CLOCAL | termios.CREAD
+            attrs[4] = attrs[5] = BAUD_RATES[self.baud]
+            termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        except (OSError, termios.error):
+            # Not a usable serial port; do not leave a half-open fd that looks online
+            os.close(fd)
+            raise
+
+        self.fd = fd
+        self._loop.add_reader(self.fd, self._on_readable)
+        logger.info(f"Board {self.board_id} opened on {self.path} at {self.baud} baud")
+
+    def close(self):
+        """Stop the command worker and release the port"""
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+        if self._reopen_task:
+            self._reopen_task.cancel()
+            self._reopen_task = None
+        self._release_port()
+        logger.info(f"Board {self.board_id} closed")
+
+    def _release_port(self):
+        if self.fd is not None:
+            self._loop.remove_reader(self.fd)
+            if self._writing:
+                self._loop.remove_writer(self.fd)
+                self._writing = False
+            os.close(self.fd)
+            self.fd = None
+        self._rx.clear()
+        self._tx.clear()
+        if self._reply and not self._reply.done():
+            self._reply.set_result(None)
+
+    def _port_lost(self):
+        """Release a failed port, fail its queued commands and start reopening it"""
+        self._release_port()
+        # Commands queued for a dead port would never be answered
+        while not self.commands.empty():
+            self.commands.get_nowait()
+        self._status_queued = False
+        if self.on_line:
+            self.on_line(self, OFFLINE_ERROR)
+        self._reopen_task = self._loop.create_task(self._reopen())
+
+    async def _reopen(self):
+        """Reopen the port with exponential backoff (e.g. after a USB unplug)"""
+        delay = REOPEN_DELAY
+        while self.fd is None:
+            await asyncio.sleep(delay)
+            try:
+                self._open_port()
+            except (OSError, termios.error) as e:
+                logger.warning(f"Board {self.board_id} still unavailable: {e}")
+                delay = min(delay * 2, REOPEN_MAX_DELAY)
+        self._reopen_task = None
+
+    def _on_readable(self):
+        """Read whatever is available and hand complete lines to on_line"""
+        try:
+            data = os.read(self.fd, READ_CHUNK)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.error(f"Board {self.board_id} read error: {e}")
+            self._port_lost()
+            return
+
+        if not data:
+            # End of file: the device went away (hangup), not just an idle line
+            logger.error(f"Board {self.board_id} hung up")
+            self._port_lost()
+            return
+
+        self._rx += data
+        if b"\n" not in data:
+            # Drop runaway garbage (e.g. wrong baud rate) instead of growing forever
+            if len(self._rx) > MAX_LINE:
+                logger.warning(f"Board {self.board_id} sent an over-long line, discarding")
+                self._rx.clear()
+            return
+
+        *lines, rest = self._rx.split(b"\n")
+        self._rx = bytearray(rest)
+        for raw in lines:
+            line = raw.strip().decode("ascii", "replace")
+            if line:
+                self._handle_line(line)
+
+    def _handle_line(self, line):
+        """Complete the outstanding command and forward the line"""
+        if self._reply and not self._reply.done() and is_reply(self._pending, line):
+            self._reply.set_result(line)
+            tracer.record(self._pending_trace, "gateway.serial_reply", board=self.board_id)
+            # ard.ino does not echo trace ids, so put it back on the ack for the cloud
+            if line.startswith("ack:"):
+                line = attach_trace(line, self._pending_trace)
+        if self.on_line:
+            self.on_line(self, line)
+
+    def submit(self, command, trace_id=None):
+        """Queue a command for the board; a status request already waiting is not repeated"""
+        if command == "status":
+            if self._status_queued:
+                return
+            self._status_queued = True
+        self.commands.put_nowait((command, trace_id))
+
+    def write(self, data):
+        """Queue bytes for the port, flushing as much as the driver accepts now"""
+        self._tx += data
+        if not self._writing:
+            self._flush()
+
+    def _flush(self):
+        try:
+            written = os.write(self.fd, self._tx)
+        except BlockingIOError:
+            written = 0
+        except OSError as e:
+            logger.error(f"Board {self.board_id} write error: {e}")
+            self._tx.clear()
+            written = 0
+
+        del self._tx[:written]
+        if self._tx and not self._writing:
+            self._loop.add_writer(self.fd, self._flush)
+            self._writing = True
+        elif not self._tx and self._writing:
+            self._loop.remove_writer(self.fd)
+            self._writing = False
+
+    async def _run_commands(self):
+        """Send queued commands one at a time, waiting for the board to reply to each"""
+        while True:
+            command, trace_id = await self.commands.get()
+            if command == "status":
+                self._status_queued = False
+            if not self.online:
+                continue
+            self._pending = command
+            self._pending_trace = trace_id
+            self._reply = self._loop.create_future()
+            self.write(f"{command}\n".encode("ascii"))
+            tracer.record(trace_id, "gateway.serial_written", board=self.board_id)
+            try:
+                await asyncio.wait_for(self._reply, timeout=ACK_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Board {self.board_id} did not reply to: {command}")
+            finally:
+                self._pending = None
+                self._pending_trace = None
+                self._reply = None
+
+
+class SerialGateway:
+    """Multiplexes serial-attached Arduinos onto one hardware connection to the cloud"""
+
+    def __init__(self, cloud_url, boards):
+        self.cloud_url = cloud_url
+        self.boards = {}
+        self.outbox = asyncio.Queue(maxsize=OUTBOX_SIZE)
+
+        for board_id, path, baud in boards:
+            self.boards[board_id] = SerialBoard(board_id, path, baud, on_line=self._on_board_line)
+
+    def _on_board_line(self, board, line):
+        """Queue a line from a board for the cloud, always addressed with the board id"""
+        logger.info(f"Received from board {board.board_id}: {line}")
+        # Never unaddressed: that is the directly connected ESP32's board in the cloud
+        frame = join_board(board.board_id, line)
+
+        if self.outbox.full():
+            # Keep the freshest state; old status lines are worthless once superseded
+            self.outbox.get_nowait()
+        self.outbox.put_nowait(frame)
+
+    def route_command(self, message):
+        """Queue a command from the cloud on the addressed board"""
+        if message == FORMAT_OFFER:
+            # Binary status is a websocket framing; serial boards only speak text.
+            # Not answering keeps the cloud on text frames, as with older ESP32 firmware.
+            logger.info("Declining binary status offer")
+            return False
+        board_id, command = split_board(message)
+        board = self.boards.get(board_id)
+        if board is None:
+            logger.error(f"Command for unknown board: {message}")
+            return False
+        if not board.online:
+            # Tell the cloud right away instead of queueing on a dead port
+            logger.warning(f"Command for offline board {board.board_id}: {command}")
+            self._on_board_line(board, OFFLINE_ERROR)
+            return False
+        # Trace ids stay on the gateway; the serial link only carries the command
+        command, trace_id = split_trace(command)
+        tracer.record(trace_id, "gateway.received", board=board.board_id)
+        board.submit(command, trace_id)
+        return True
+
+    def announce_boards(self):
+        """Make every board send a frame so the cloud learns the routes after a (re)connect
+
+        ard.ino only speaks unprompted when it resets, so without this the
+        cloud would not know about a board until it was power-cycled.
+        """
+        for board in self.boards.values():
+            if board.online:
+                board.submit("status")
+            else:
+                self._on_board_line(board, OFFLINE_ERROR)
+
+    async def _pump_upstream(self, websocket):
+        """Forward queued board lines to the cloud"""
+        while True:
+            frame = await self.outbox.get()
+            await websocket.send(frame)
+
+    async def run(self):
+        """Open every board and keep the upstream connection alive"""
+        for board in self.boards.values():
+            board.open()
+
+        try:
+            while True:
+                try:
+                    async with websockets.connect(self.cloud_url, ping_interval=30, ping_timeout=15) as websocket:
+                        logger.info(f"Connected to cloud server: {self.cloud_url}")
+                        self.announce_boards()
+                        pump = asyncio.create_task(self._pump_upstream(websocket))
+                        try:
+                            async for message in websocket:
+                                logger.info(f"Received from cloud: {message}")
+                                self.route_command(message)
+                        finally:
+                            pump.cancel()
+                except (OSError, websockets.ConnectionClosed) as e:
+                    logger.warning(f"Cloud connection lost: {e}")
+
+                await asyncio.sleep(RECONNECT_DELAY)
+        finally:
+            for board in self.boards.values():
+                board.close()
+
+
+def parse_board(spec, baud):
+    """Parse a "[board_id=]path" argument into (board_id, path, baud)"""
+    board_id, sep, path = spec.partition("=")
+    if not sep:
+        path = spec
+        board_id = os.path.basename(spec)
+    return board_id, path, baud
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IOTIFY serial gateway for ard.ino boards")
+    parser.add_argument("ports", nargs="+", help="serial ports as [board_id=]path")
+    parser.add_argument("--cloud", default=CLOUD_HARDWARE_URL, help="cloud hardware endpoint")
+    parser.add_argument("--baud", type=int, default=9600, choices=sorted(BAUD_RATES))
+    args = parser.parse_args()
+
+    gateway = SerialGateway(args.cloud, [parse_board(spec, args.baud) for spec in args.ports])
+    try:
+        asyncio.run(gateway.run())
+    except KeyboardInterrupt:
+        logger.info("Gateway shutting down...")
+    except Exception as e:
+        logger.error(f"Gateway error: {e}")
@@ -0,0 +1,98 @@
+"""Message framing shared by the cloud server, the serial gateway and the boards"""
+
+# Frames on the hardware port (8766) may be addressed to a single board behind
+# a gateway as "board|payload"; gateways address every frame. Unaddressed frames
+# belong to the default board, which is how a directly connected ESP32 talks
+# to the cloud.
+BOARD_SEPARATOR = "|"
+
+
+def split_board(message):
+    """Split a hardware frame into (board, payload); board is None if unaddressed"""
+    board, sep, payload = message.partition(BOARD_SEPARATOR)
+    if not sep:
+        return None, message
+    return board, payload
+
+
+def join_board(board, payload):
+    """Address a hardware frame to a board (None for the default board)"""
+    if not board:
+        return payload
+    return f"{board}{BOARD_SEPARATOR}{payload}"
+
+
+# A sampled control command carries its trace id as "pin,state@trace"; boards
+# echo it back in the ack ("ack:pin,state@trace"). Firmware that predates
+# tracing still works because "1@trace".toInt() is 1.
+TRACE_SEPARATOR = "@"
+
+
+def split_trace(message):
+    """Split a frame into (payload, trace_id); trace_id is None if untraced"""
+    payload, sep, trace_id = message.partition(TRACE_SEPARATOR)
+    if not sep:
+        return message, None
+    return payload, trace_id
+
+
+def attach_trace(payload, trace_id):
+    """Append a trace id to a frame (no-op for untraced frames)"""
+    if not trace_id:
+        return payload
+    return f"{payload}{TRACE_SEPARATOR}{trace_id}"
+
+
+# Boards may report status as a compact binary websocket frame instead of
+# "5:0,6:1,7:0,8:0". The cloud offers it with "format:bin"; firmware that
+# supports it answers "format:bin:<pin>,<pin>,..." listing the pins in bit
+# order and switches to binary frames, older firmware ignores the offer.
+#
+#   byte 0      STATUS_MAGIC
+#   bytes 1-2   sequence number, little-endian, wrapping at 65536
+#   bytes 3-    pin states, bit i = i-th negotiated pin
+STATUS_MAGIC = 0xB5
+FORMAT_OFFER = "format:bin"
+FORMAT_REPLY_PREFIX = "format:bin:"
+
+
+def parse_format_reply(message):
+    """Return the pin order announced in a "format:bin:5,6,7,8" reply"""
+    return [int(pin) for pin in message[len(FORMAT_REPLY_PREFIX):].split(",") if pin]
+
+
+def decode_status(frame, pins=None):
+    """Decode a text or binary status frame into ({pin: state}, seq)
+
+    seq is None for text frames; binary frames need the negotiated pin order.
+    """
+    if isinstance(frame, str):
+        states = {}
+        for pair in frame.split(","):
+            pin, sep, state = pair.partition(":")
+            if sep:
+                states[int(pin)] = int(state)
+        return states, None
+
+    if pins is None:
+        raise ValueError("Binary status frame from a board that did not negotiate it")
+    if len(frame) < 3 or frame[0] != STATUS_MAGIC:
+        raise ValueError("Malformed binary status frame")
+    seq = frame[1] | frame[2] << 8
+    mask = int.from_bytes(frame[3:], "little")
+    return {pin: mask >> bit & 1 for bit, pin in enumerate(pins)}, seq
+
+
+def encode_status(states, pins, seq):
+    """Build a binary status frame (the layout the firmware sends)"""
+    mask = 0
+    for bit, pin in enumerate(pins):
+        if states.get(pin):
+            mask |= 1 << bit
+    header = bytes((STATUS_MAGIC, seq & 0xFF, seq >> 8 & 0xFF))
+    return header + mask.to_bytes((len(pins) + 7) // 8, "little")
+
+
+def is_newer(seq, last):
+    """Whether a status sequence number comes after the last one seen (mod 65536)"""
+    return 0 < (seq - last) % 65536 < 32768
@@ -0,0 +1,137 @@
+SLOTS_PER_BOARD = 64  # Pin slots per board; pin n lives in slot n
+INITIAL_CAPACITY = 16  # Boards allocated up front
+DIFF_BLOCK = 4096  # Bytes compared at once when diffing against a snapshot
+
+
+class StateTable:
+    """Pin states of the whole fleet packed into one bitset, one fixed-width row per board
+
+    Row r holds the board's pins in bits r*stride*8 .. (r+1)*stride*8 - 1,
+    little-endian, so a board costs 8 bytes of state plus 8 bytes of "known"
+    mask and a million pins fit in about 250 KB. set/get touch one byte.
+    A fleet-wide snapshot is a single buffer copy (states, then known bits),
+    and a diff compares 4 KB blocks of both with memcmp and decodes only the
+    blocks that changed, so neither loops over boards in Python. A pin that
+    becomes known counts as a change even if it reports 0.
+    """
+
+    def __init__(self, slots=SLOTS_PER_BOARD):
+        self.slots = slots
+        self.stride = (slots + 7) // 8
+        self._rows = {}     # board -> row
+        self._boards = []   # row -> board
+        self._values = bytearray(INITIAL_CAPACITY * self.stride)
+        self._known = bytearray(INITIAL_CAPACITY * self.stride)
+
+    def __len__(self):
+        return len(self._boards)
+
+    def __contains__(self, board):
+        return board in self._rows
+
+    @property
+    def boards(self):
+        """Boards in row order"""
+        return list(self._boards)
+
+    def _row(self, board):
+        row = self._rows.get(board)
+        if row is None:
+            row = len(self._boards)
+            if (row + 1) * self.stride > len(self._values):
+                self._grow()
+            self._rows[board] = row
+            self._boards.append(board)
+        return row
+
+    def _grow(self):
+        # New buffers instead of resizing in place: views handed out by view()
+        # keep pointing at the old (still valid) buffers instead of blocking growth
+        size = len(self._values) * 2
+        values = bytearray(size)
+        values[:len(self._values)] = self._values
+        known = bytearray(size)
+        known[:len(self._known)] = self._known
+        self._values, self._known = values, known
+
+    def _locate(self, board, pin):
+        if not 0 <= pin < self.slots:
+            raise ValueError(f"Pin {pin} outside the {self.slots} slots of a board")
+        return self._row(board) * self.stride + (pin >> 3), 1 << (pin & 7)
+
+    def set(self, board, pin, state):
+        """Set a pin of a board to 0 or 1"""
+        offset, bit = self._locate(board, pin)
+        if state:
+            self._values[offset] |= bit
+        else:
+            self._values[offset] &= ~bit
+        self._known[offset] |= bit
+
+    def get(self, board, pin):
+        """Return the state of a pin (0 or 1), or None if the board never reported it"""
+        if board not in self._rows:
+            return None
+        offset, bit = self._locate(board, pin)
+        if not self._known[offset] & bit:
+            return None
+        return 1 if self._values[offset] & bit else 0
+
+    def update(self, board, states):
+        """Set several pins of a board from a {pin: state} mapping"""
+        for pin, state in states.items():
+            self.set(board, pin, state)
+
+    def board_states(self, board):
+        """Return the known pins of a board as {"pin": "state"} strings"""
+        if board not in self._rows:
+            return {}
+        start = self._rows[board] * self.stride
+        end = start + self.stride
+        values = int.from_bytes(self._values[start:end], "little")
+        known = int.from_bytes(self._known[start:end], "little")
+
+        states = {}
+        while known:
+            low = known & -known
+            pin = low.bit_length() - 1
+            states[str(pin)] = "1" if values & low else "0"
+            known ^= low
+        return states
+
+    def snapshot(self):
+        """Return an immutable copy of every board's states followed by their known bits"""
+        size = len(self._boards) * self.stride
+        return b"".join((memoryview(self._values)[:size], memoryview(self._known)[:size]))
+
+    def diff(self, snapshot):
+        """Return [(board, pin, state)] for every pin that changed or became known since a snapshot"""
+        size = len(self._boards) * self.stride
+        before = memoryview(snapshot)
+        half = len(before) // 2
+        # Boards added since the snapshot have short (or empty) slices: all unknown before
+        before_values, before_known = before[:half], before[half:]
+
+        changes = []
+        for start in range(0, size, DIFF_BLOCK):
+            end = min(start + DIFF_BLOCK, size)
+            current = self._values[start:end]
+            known = self._known[start:end]
+            if current == before_values[start:end] and known == before_known[start:end]:
+                # memcmp over a whole block; the common case for a quiet fleet
+                continue
+
+            value = int.from_bytes(current, "little")
+            changed = value ^ int.from_bytes(before_values[start:end], "little")
+            changed |= int.from_bytes(known, "little") ^ int.from_bytes(before_known[start:end], "little")
+            while changed:
+                low = changed & -changed
+                position = start * 8 + low.bit_length() - 1
+                row, pin = divmod(position, self.stride * 8)
+                changes.append((self._boards[row], pin, 1 if value & low else 0))
+                changed ^= low
+        return changes
+
+    def view(self):
+        """Return a read-only, zero-copy view of the packed states for serialization"""
+        return memoryview(self._values).toreadonly()[:len(self._boards) * self.stride]
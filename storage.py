@@ -0,0 +1,245 @@
+import logging
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_INTERVAL = 5.0  # Seconds between attempts to reach a database that is down
+IDLE_PING_INTERVAL = 300.0  # Seconds a MySQL connection may sit idle before it is pinged
+
+
+class Storage(ABC):
+    """User and device store used by the cloud server"""
+
+    @abstractmethod
+    def connect(self):
+        """Open the connection; return True on success"""
+
+    @abstractmethod
+    def ensure_connected(self):
+        """Return True if the store is usable, reconnecting if needed"""
+
+    @abstractmethod
+    def get_password(self, username):
+        """Return the stored password of a user, or None if the user does not exist"""
+
+    @abstractmethod
+    def get_devices(self, username):
+        """Return the device rows of a user: (userid, device_name, device_id, pin, state[, board])
+
+        The optional board column names the gateway board a device is wired
+        to; NULL (or a missing column) means the directly connected ESP32.
+        """
+
+    @abstractmethod
+    def close(self):
+        """Release the connection"""
+
+
+class MySQLStorage(Storage):
+    """MySQL store using server-side prepared statements
+
+    A live connection is trusted without a round trip; a query that fails
+    with a connection error reconnects and is retried once, and only a
+    connection idle for IDLE_PING_INTERVAL is pinged before use.
+    """
+
+    LOGIN_QUERY = "SELECT * FROM login WHERE username=%s"
+    DEVICES_QUERY = "SELECT * FROM devices WHERE userid=%s"
+    # (table, column, DDL) for the lookup indexes; created only if the column
+    # does not already lead some index (a PRIMARY or UNIQUE key counts)
+    INDEXES = (
+        ("login", "username", "CREATE INDEX idx_login_username ON login (username)"),
+        ("devices", "userid", "CREATE INDEX idx_devices_userid ON devices (userid)"),
+    )
+    INDEX_QUERY = (
+        "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() "
+        "AND TABLE_NAME = %s AND COLUMN_NAME = %s AND SEQ_IN_INDEX = 1 LIMIT 1"
+    )
+
+    def __init__(self, **config):
+        self.config = config
+        self.con = None
+        self._login_cursor = None
+        self._devices_cursor = None
+        self._last_attempt = 0.0
+        self._last_used = 0.0
+        self._connection_errors = ()
+        self._indexes_checked = False
+
+    def connect(self):
+        self._last_attempt = time.monotonic()
+        try:
+            import mysql.connector as ms
+
+            # Errors that mean the connection itself is gone, not that the query is bad
+            self._connection_errors = (ms.OperationalError, ms.InterfaceError)
+            self.con = ms.connect(**self.config)
+            # One prepared cursor per query so each statement is prepared once and reused
+            self._login_cursor = self.con.cursor(prepared=True)
+            self._devices_cursor = self.con.cursor(prepared=True)
+            if not self._indexes_checked:
+                # Once per process, not on every reconnect
+                self._ensure_indexes(ms)
+                self._indexes_checked = True
+            self._last_used = time.monotonic()
+            logger.info("Database connected successfully")
+            return True
+        except Exception as e:
+            logger.error(f"Database connection failed: {e}")
+            self.con = None
+            return False
+
+    def _ensure_indexes(self, ms):
+        cursor = self.con.cursor()
+        try:
+            for table, column, statement in self.INDEXES:
+                try:
+                    cursor.execute(self.INDEX_QUERY, (table, column))
+                    if cursor.fetchall():
+                        continue
+                    logger.info(f"Creating index on {table}.{column}")
+                    cursor.execute(statement)
+                except ms.Error as e:
+                    logger.warning(f"Could not create index on {table}.{column}: {e}")
+        finally:
+            cursor.close()
+
+    def ensure_connected(self):
+        if self.con is not None:
+            if time.monotonic() - self._last_used < IDLE_PING_INTERVAL:
+                return True
+            # Idle long enough for the server's wait_timeout to have dropped us
+            try:
+                self.con.ping()
+                self._last_used = time.monotonic()
+                return True
+            except self._connection_errors as e:
+                logger.warning(f"Idle database connection lost: {e}")
+                self._drop()
+                return self.connect()
+        if time.monotonic() - self._last_attempt < RECONNECT_INTERVAL:
+            return False
+        return self.connect()
+
+    def _query(self, cursor_name, query, params):
+        """Run a prepared query, reconnecting and retrying once if the connection dropped"""
+        try:
+            getattr(self, cursor_name).execute(query, params)
+            rows = getattr(self, cursor_name).fetchall()
+        except self._connection_errors as e:
+            logger.warning(f"Database connection lost, reconnecting: {e}")
+            self._drop()
+            if not self.connect():
+                raise
+            getattr(self, cursor_name).execute(query, params)
+            rows = getattr(self, cursor_name).fetchall()
+        self._last_used = time.monotonic()
+        return rows
+
+    def get_password(self, username):
+        rows = self._query("_login_cursor", self.LOGIN_QUERY, (username,))
+        if not rows:
+            return None
+        return rows[0][2]
+
+    def get_devices(self, username):
+        return self._query("_devices_cursor", self.DEVICES_QUERY, (username,))
+
+    def _drop(self):
+        """Forget a broken connection without waiting on the server"""
+        try:
+            self.con.close()
+        except Exception:
+            pass
+        self.con = None
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+
+class SQLiteStorage(Storage):
+    """Embedded SQLite store in WAL mode for single-node deployments
+
+    sqlite3 keeps a per-connection cache of compiled statements keyed by SQL
+    text, so the constant parameterised queries below are prepared once.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS login ("
+        "id INTEGER PRIMARY KEY, username TEXT NOT NULL, password TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS devices ("
+        "userid TEXT NOT NULL, device_name TEXT NOT NULL, device_id TEXT NOT NULL, "
+        "pin INTEGER NOT NULL, state TEXT NOT NULL DEFAULT '0', board TEXT)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_login_username ON login (username)",
+        "CREATE INDEX IF NOT EXISTS idx_devices_userid ON devices (userid)",
+    )
+    LOGIN_QUERY = "SELECT password FROM login WHERE username=?"
+    DEVICES_QUERY = "SELECT userid, device_name, device_id, pin, state, board FROM devices WHERE userid=?"
+
+    def __init__(self, path="iotify.db"):
+        self.path = path
+        self.con = None
+
+    def connect(self):
+        try:
+            self.con = sqlite3.connect(self.path)
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("PRAGMA synchronous=NORMAL")
+            with self.con:
+                for statement in self.SCHEMA:
+                    self.con.execute(statement)
+                # Databases created before devices had a board column
+                columns = [row[1] for row in self.con.execute("PRAGMA table_info(devices)")]
+                if "board" not in columns:
+                    self.con.execute("ALTER TABLE devices ADD COLUMN board TEXT")
+            logger.info(f"SQLite database opened: {self.path}")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"SQLite database failed to open: {e}")
+            self.con = None
+            return False
+
+    def ensure_connected(self):
+        if self.con is not None:
+            return True
+        return self.connect()
+
+    def get_password(self, username):
+        row = self.con.execute(self.LOGIN_QUERY, (username,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def get_devices(self, username):
+        return self.con.execute(self.DEVICES_QUERY, (username,)).fetchall()
+
+    def add_user(self, username, password):
+        """Create a user (SQLite deployments have no separate admin tooling)"""
+        with self.con:
+            self.con.execute("INSERT INTO login (username, password) VALUES (?, ?)", (username, password))
+
+    def add_device(self, username, device_name, device_id, pin, state="0", board=None):
+        """Register a device for a user (board None is the directly connected ESP32)"""
+        with self.con:
+            self.con.execute(
+                "INSERT INTO devices (userid, device_name, device_id, pin, state, board) VALUES (?, ?, ?, ?, ?, ?)",
+                (username, device_name, device_id, pin, state, board)
+            )
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+
+def create_storage(backend, **config):
+    """Build the storage backend named in the config ("mysql" or "sqlite")"""
+    if backend == "mysql":
+        return MySQLStorage(**config)
+    if backend == "sqlite":
+        return SQLiteStorage(**config)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,372 @@
+"""SerialBoard / SerialGateway driven through pseudo-terminals standing in for Arduinos"""
+import asyncio
+import os
+import pty
+
+import pytest
+
+import gateway
+
+
+class Port:
+    """The Arduino end of a pty; the gateway opens the slave path like a real serial port"""
+
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        self.path = os.ttyname(self.slave)
+        os.set_blocking(self.master, False)
+        self._rx = b""
+
+    def send(self, data):
+        os.write(self.master, data)
+
+    async def read_line(self, timeout=1.0):
+        """Return the next line the gateway wrote, or None if nothing arrives in time"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while b"\n" not in self._rx:
+            if asyncio.get_running_loop().time() > deadline:
+                return None
+            try:
+                self._rx += os.read(self.master, 1024)
+            except BlockingIOError:
+                await asyncio.sleep(0.01)
+        line, _, self._rx = self._rx.partition(b"\n")
+        return line.decode("ascii")
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+@pytest.fixture
+def ports():
+    opened = []
+
+    def make():
+        port = Port()
+        opened.append(port)
+        return port
+
+    yield make
+    for port in opened:
+        port.close()
+
+
+async def settle():
+    await asyncio.sleep(0.05)
+
+
+def test_lines_split_across_reads(ports):
+    port = ports()
+    lines = []
+
+    async def main():
+        board = gateway.SerialBoard("b0", port.path, on_line=lambda board, line: lines.append(line))
+        board.open()
+        try:
+            port.send(b"5:0,6")
+            await settle()
+            assert lines == []
+            port.send(b":1,7:0,8:0\r\nack:5,")
+            await settle()
+            port.send(b"1\r\n")
+            await settle()
+        finally:
+            board.close()
+
+    asyncio.run(main())
+    assert lines == ["5:0,6:1,7:0,8:0", "ack:5,1"]
+
+
+def test_overlong_line_is_discarded(ports):
+    port = ports()
+    lines = []
+
+    async def main():
+        board = gateway.SerialBoard("b0", port.path, on_line=lambda board, line: lines.append(line))
+        board.open()
+        try:
+            port.send(b"\xff" * (gateway.MAX_LINE + 1))
+            await settle()
+            port.send(b"ack:5,1\r\n")
+            await settle()
+        finally:
+            board.close()
+
+    asyncio.run(main())
+    assert lines == ["ack:5,1"]
+
+
+def test_one_command_in_flight_per_board(ports):
+    port = ports()
+
+    async def main():
+        board = gateway.SerialBoard("b0", port.path)
+        board.open()
+        try:
+            board.commands.put_nowait(("5,1", None))
+            board.commands.put_nowait(("6,1", None))
+            assert await port.read_line() == "5,1"
+            # The second command waits for the board to answer the first
+            assert await port.read_line(timeout=0.2) is None
+            port.send(b"ack:5,1\r\n")
+            assert await port.read_line() == "6,1"
+        finally:
+            board.close()
+
+    asyncio.run(main())
+
+
+def test_unanswered_command_times_out(ports, monkeypatch):
+    monkeypatch.setattr(gateway, "ACK_TIMEOUT", 0.1)
+    port = ports()
+
+    async def main():
+        board = gateway.SerialBoard("b0", port.path)
+        board.open()
+        try:
+            board.commands.put_nowait(("5,1", None))
+            board.commands.put_nowait(("6,1", None))
+            assert await port.read_line() == "5,1"
+            # No ack: the worker gives up after ACK_TIMEOUT and moves on
+            assert await port.read_line() == "6,1"
+        finally:
+            board.close()
+
+    asyncio.run(main())
+
+
+def test_late_ack_does_not_complete_the_next_command(ports, monkeypatch):
+    monkeypatch.setattr(gateway, "ACK_TIMEOUT", 0.1)
+    monkeypatch.setattr(gateway.tracer, "record", lambda *args, **fields: None)
+    port = ports()
+
+    async def main():
+        gw = gateway.SerialGateway("ws://cloud", [("b0", port.path, 9600)])
+        board = gw.boards["b0"]
+        board.open()
+        try:
+            assert gw.route_command("b0|5,1@aaaa")
+            assert await port.read_line() == "5,1"
+            await asyncio.sleep(0.15)
+            monkeypatch.setattr(gateway, "ACK_TIMEOUT", 1.0)
+            assert gw.route_command("b0|6,1@bbbb")
+            assert await port.read_line() == "6,1"
+
+            # The ack of the timed-out command arrives while 6,1 is pending
+            port.send(b"ack:5,1\r\n")
+            await settle()
+            assert board._reply is not None and not board._reply.done()
+            port.send(b"ack:6,1\r\n")
+            await settle()
+            assert board._reply is None
+            frames = [gw.outbox.get_nowait() for _ in range(gw.outbox.qsize())]
+            assert frames == ["b0|ack:5,1", "b0|ack:6,1@bbbb"]
+        finally:
+            board.close()
+
+    asyncio.run(main())
+
+
+def test_status_line_does_not_complete_a_control_command(ports):
+    port = ports()
+
+    async def main():
+        board = gateway.SerialBoard("b0", port.path)
+        board.open()
+        try:
+            board.commands.put_nowait(("5,1", None))
+            board.commands.put_nowait(("status", None))
+            assert await port.read_line() == "5,1"
+            port.send(b"5:0,6:0,7:0,8:0\r\n")
+            assert await port.read_line(timeout=0.2) is None
+            port.send(b"ack:5,1\r\n")
+            assert await port.read_line() == "status"
+        finally:
+            board.close()
+
+    asyncio.run(main())
+
+
+def test_queued_status_requests_are_not_repeated(ports):
+    port = ports()
+
+    async def main():
+        gw = gateway.SerialGateway("ws://cloud", [("b0", port.path, 9600)])
+        gw.boards["b0"].open()
+        try:
+            assert gw.route_command("b0|5,1")
+            assert await port.read_line() == "5,1"
+            # While 5,1 waits for its ack, polls pile up behind it
+            for _ in range(3):
+                assert gw.route_command("b0|status")
+            assert gw.route_command("b0|6,1")
+            assert gw.boards["b0"].commands.qsize() == 2
+
+            port.send(b"ack:5,1\r\n")
+            assert await port.read_line() == "status"
+            port.send(b"5:1,6:0,7:0,8:0\r\n")
+            assert await port.read_line() == "6,1"
+        finally:
+            gw.boards["b0"].close()
+
+    asyncio.run(main())
+
+
+def test_route_command_to_addressed_boards(ports):
+    first, second = ports(), ports()
+
+    async def main():
+        gw = gateway.SerialGateway("ws://cloud", [("b0", first.path, 9600), ("b1", second.path, 9600)])
+        for board in gw.boards.values():
+            board.open()
+        try:
+            assert gw.route_command("b0|5,1")
+            assert gw.route_command("b1|6,0")
+            assert gw.route_command("b0|7,1")
+            assert not gw.route_command("b9|5,1")
+            # Unaddressed commands belong to a directly connected ESP32, not to any board here
+            assert not gw.route_command("5,1")
+            assert await first.read_line() == "5,1"
+            assert await second.read_line() == "6,0"
+
+            # Replies go upstream addressed, including the first board's
+            first.send(b"ack:5,1\r\n")
+            second.send(b"ack:6,0\r\n")
+            assert await first.read_line() == "7,1"
+            await settle()
+            frames = [gw.outbox.get_nowait() for _ in range(gw.outbox.qsize())]
+            assert sorted(frames) == ["b0|ack:5,1", "b1|ack:6,0"]
+        finally:
+            for board in gw.boards.values():
+                board.close()
+
+    asyncio.run(main())
+
+
+def test_binary_status_offer_is_not_forwarded(ports):
+    port = ports()
+
+    async def main():
+        gw = gateway.SerialGateway("ws://cloud", [("b0", port.path, 9600)])
+        gw.boards["b0"].open()
+        try:
+            assert not gw.route_command("format:bin")
+            assert await port.read_line(timeout=0.2) is None
+            assert gw.outbox.empty()
+        finally:
+            gw.boards["b0"].close()
+
+    asyncio.run(main())
+
+
+def test_trace_id_stays_on_the_gateway(ports, monkeypatch):
+    monkeypatch.setattr(gateway.tracer, "record", lambda *args, **fields: None)
+    port = ports()
+
+    async def main():
+        gw = gateway.SerialGateway("ws://cloud", [("b0", port.path, 9600)])
+        gw.boards["b0"].open()
+        try:
+            assert gw.route_command("b0|5,1@beef")
+            assert await port.read_line() == "5,1"
+            port.send(b"ack:5,1\r\n")
+            await settle()
+            assert gw.outbox.get_nowait() == "b0|ack:5,1@beef"
+        finally:
+            gw.boards["b0"].close()
+
+    asyncio.run(main())
+
+
+def test_announce_boards_polls_every_board(ports):
+    first, second = ports(), ports()
+
+    async def main():
+        gw = gateway.SerialGateway("ws://cloud", [("b0", first.path, 9600), ("b1", second.path, 9600)])
+        for board in gw.boards.values():
+            board.open()
+        try:
+            gw.announce_boards()
+            assert await first.read_line() == "status"
+            assert await second.read_line() == "status"
+        finally:
+            for board in gw.boards.values():
+                board.close()
+
+    asyncio.run(main())
+
+
+def test_outbox_drops_oldest_frame_when_full(monkeypatch):
+    monkeypatch.setattr(gateway, "OUTBOX_SIZE", 2)
+    gw = gateway.SerialGateway("ws://cloud", [("b0", "/dev/null", 9600), ("b1", "/dev/null", 9600)])
+
+    gw._on_board_line(gw.boards["b0"], "5:0")
+    gw._on_board_line(gw.boards["b1"], "5:1")
+    gw._on_board_line(gw.boards["b0"], "5:1")
+
+    assert [gw.outbox.get_nowait() for _ in range(gw.outbox.qsize())] == ["b1|5:1", "b0|5:1"]
+
+
+def test_hung_up_board_rejects_commands(ports, monkeypatch):
+    monkeypatch.setattr(gateway, "REOPEN_DELAY", 10.0)
+    port = ports()
+
+    async def main():
+        gw = gateway.SerialGateway("ws://cloud", [("b0", port.path, 9600)])
+        board = gw.boards["b0"]
+        board.open()
+        try:
+            port.close()
+            await settle()
+            assert not board.online
+            assert not gw.route_command("b0|5,1")
+            frames = [gw.outbox.get_nowait() for _ in range(gw.outbox.qsize())]
+            assert frames == [f"b0|{gateway.OFFLINE_ERROR}"] * 2
+        finally:
+            board.close()
+
+    asyncio.run(main())
+
+
+def test_missing_port_is_reopened_in_the_background(ports, monkeypatch, tmp_path):
+    monkeypatch.setattr(gateway, "REOPEN_DELAY", 0.05)
+    port = ports()
+    path = tmp_path / "ttyACM0"
+
+    async def main():
+        gw = gateway.SerialGateway("ws://cloud", [("b0", str(path), 9600), ("b1", port.path, 9600)])
+        for board in gw.boards.values():
+            board.open()
+        try:
+            # The missing port does not take the other board down with it
+            assert not gw.boards["b0"].online
+            assert gw.boards["b1"].online
+            assert gw.outbox.get_nowait() == f"b0|{gateway.OFFLINE_ERROR}"
+
+            path.symlink_to(port.path)
+            await asyncio.sleep(0.2)
+            assert gw.boards["b0"].online
+        finally:
+            for board in gw.boards.values():
+                board.close()
+
+    asyncio.run(main())
+
+
+def test_non_tty_port_is_not_left_half_open(tmp_path):
+    path = tmp_path / "not-a-tty"
+    path.write_text("")
+
+    async def main():
+        board = gateway.SerialBoard("b0", str(path))
+        board.open()
+        try:
+            assert not board.online
+        finally:
+            board.close()
+
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+import pytest
+
+from protocol import (
+    STATUS_MAGIC, attach_trace, decode_status, encode_status, is_newer,
+    join_board, parse_format_reply, split_board, split_trace,
+)
+
+PINS = [5, 6, 7, 8]
+
+
+def test_board_addressing_round_trip():
+    assert split_board("b1|5,1") == ("b1", "5,1")
+    assert split_board("5,1") == (None, "5,1")
+    assert join_board("b1", "5,1") == "b1|5,1"
+    assert join_board(None, "5,1") == "5,1"
+
+
+def test_trace_round_trip():
+    assert split_trace("5,1@beef") == ("5,1", "beef")
+    assert split_trace("5,1") == ("5,1", None)
+    assert attach_trace("5,1", None) == "5,1"
+    assert split_trace(attach_trace("ack:5,1", "beef")) == ("ack:5,1", "beef")
+
+
+def test_parse_format_reply():
+    assert parse_format_reply("format:bin:5,6,7,8") == PINS
+    assert parse_format_reply("format:bin:") == []
+
+
+def test_decode_text_status():
+    assert decode_status("5:0,6:1,7:0,8:1") == ({5: 0, 6: 1, 7: 0, 8: 1}, None)
+    # Pairs without a colon are skipped
+    assert decode_status("5:1,junk") == ({5: 1}, None)
+
+
+def test_binary_status_round_trip():
+    states = {5: 1, 6: 0, 7: 1, 8: 1}
+    frame = encode_status(states, PINS, 513)
+
+    assert frame == bytes((STATUS_MAGIC, 0x01, 0x02, 0b1101))
+    assert decode_status(frame, PINS) == (states, 513)
+
+
+def test_binary_status_spans_several_bytes():
+    pins = list(range(2, 14))
+    states = {pin: pin % 3 == 0 for pin in pins}
+    frame = encode_status(states, pins, 7)
+
+    assert len(frame) == 3 + 2
+    assert decode_status(frame, pins) == ({pin: int(state) for pin, state in states.items()}, 7)
+
+
+def test_binary_status_without_negotiation_is_rejected():
+    with pytest.raises(ValueError):
+        decode_status(encode_status({5: 1}, PINS, 0))
+
+
+@pytest.mark.parametrize("frame", [b"", bytes((STATUS_MAGIC, 0)), bytes((0x00, 0, 0, 0))])
+def test_malformed_binary_status_is_rejected(frame):
+    with pytest.raises(ValueError):
+        decode_status(frame, PINS)
+
+
+def test_sequence_numbers_wrap_around():
+    assert is_newer(1, 0)
+    assert is_newer(0, 65535)
+    assert is_newer(10, 65530)
+    assert not is_newer(65535, 0)
+    assert not is_newer(5, 5)
+    assert not is_newer(4, 5)
+
+
+def test_apply_status_drops_stale_and_duplicate_frames():
+    from cloud import ESPController
+
+    controller = ESPController()
+    controller.status_pins[None] = PINS
+
+    assert controller.apply_status(None, encode_status({5: 1}, PINS, 65535)) == {5: 1, 6: 0, 7: 0, 8: 0}
+    # Duplicate and older frames leave the cache alone
+    assert controller.apply_status(None, encode_status({5: 0}, PINS, 65535)) is None
+    assert controller.apply_status(None, encode_status({5: 0}, PINS, 65534)) is None
+    assert controller.states.get(None, 5) == 1
+    # 65535 -> 0 is a step forward, not a restart
+    assert controller.apply_status(None, encode_status({6: 1}, PINS, 0)) == {5: 0, 6: 1, 7: 0, 8: 0}
+    assert controller.states.get(None, 6) == 1
+    assert controller.status_seq[None] == 0
+
+
+def test_apply_status_accepts_text_frames_without_a_sequence():
+    from cloud import ESPController
+
+    controller = ESPController()
+    assert controller.apply_status("b1", "5:1,6:0") == {5: 1, 6: 0}
+    assert controller.apply_status("b1", "5:0,6:0") == {5: 0, 6: 0}
+    assert "b1" not in controller.status_seq
@@ -0,0 +1,115 @@
+import pytest
+
+from state_table import DIFF_BLOCK, StateTable
+
+
+def test_set_and_get():
+    table = StateTable()
+    table.set("b0", 5, 1)
+    table.set("b0", 6, 0)
+    table.set("b1", 63, 1)
+
+    assert table.get("b0", 5) == 1
+    assert table.get("b0", 6) == 0
+    assert table.get("b1", 63) == 1
+    table.set("b0", 5, 0)
+    assert table.get("b0", 5) == 0
+
+
+def test_unknown_pins_and_boards_read_as_none():
+    table = StateTable()
+    table.set("b0", 5, 0)
+
+    assert table.get("b0", 7) is None
+    assert table.get("missing", 5) is None
+    assert "missing" not in table
+    assert len(table) == 1
+
+
+@pytest.mark.parametrize("pin", [-1, 64])
+def test_pins_outside_the_slots_are_rejected(pin):
+    table = StateTable()
+    with pytest.raises(ValueError):
+        table.set("b0", pin, 1)
+
+
+def test_board_states():
+    table = StateTable()
+    table.update(None, {5: 0, 6: 1, 7: 0, 8: 1})
+
+    assert table.board_states(None) == {"5": "0", "6": "1", "7": "0", "8": "1"}
+    assert table.board_states("missing") == {}
+
+
+def test_grow_keeps_handed_out_views_valid():
+    table = StateTable()
+    table.update("b0", {5: 1})
+    view = table.view()
+    before = bytes(view)
+
+    for board in range(1, 1000):
+        table.update(f"b{board}", {6: 1})
+
+    # The old view still reads the states as they were when it was taken
+    assert bytes(view) == before
+    assert view.readonly
+    assert table.get("b0", 5) == 1
+    assert table.get("b999", 6) == 1
+    assert len(table.view()) == 1000 * table.stride
+
+
+def test_diff_reports_changes_across_block_boundaries():
+    table = StateTable()
+    boards_per_block = DIFF_BLOCK // table.stride
+    for board in range(boards_per_block * 2 + 10):
+        table.update(board, {5: 0, 6: 0})
+    snapshot = table.snapshot()
+
+    last_of_first_block = boards_per_block - 1
+    first_of_second_block = boards_per_block
+    table.set(last_of_first_block, 63, 1)
+    table.set(first_of_second_block, 0, 1)
+    table.set(boards_per_block * 2 + 5, 6, 1)
+
+    assert sorted(table.diff(snapshot)) == [
+        (last_of_first_block, 63, 1),
+        (first_of_second_block, 0, 1),
+        (boards_per_block * 2 + 5, 6, 1),
+    ]
+
+
+def test_diff_of_unchanged_table_is_empty():
+    table = StateTable()
+    table.update("b0", {5: 1, 6: 0})
+    snapshot = table.snapshot()
+    table.update("b0", {5: 1, 6: 0})
+
+    assert table.diff(snapshot) == []
+
+
+def test_diff_reports_pins_first_reported_as_zero():
+    table = StateTable()
+    table.update("b0", {5: 1})
+    snapshot = table.snapshot()
+    table.set("b0", 6, 0)
+
+    assert table.diff(snapshot) == [("b0", 6, 0)]
+
+
+def test_diff_reports_boards_added_after_the_snapshot():
+    table = StateTable()
+    table.update("b0", {5: 1})
+    snapshot = table.snapshot()
+    table.update("b1", {5: 0, 6: 1})
+
+    assert sorted(table.diff(snapshot)) == [("b1", 5, 0), ("b1", 6, 1)]
+
+
+def test_snapshot_is_immutable_copy():
+    table = StateTable()
+    table.set("b0", 5, 1)
+    snapshot = table.snapshot()
+    table.set("b0", 5, 0)
+
+    assert isinstance(snapshot, bytes)
+    assert table.diff(snapshot) == [("b0", 5, 0)]
@@ -0,0 +1,103 @@
+"""Per-stage latency breakdown of traced device toggles
+
+Collect the span files written by client.py, cloud.py and gateway.py
+(client_trace.log, cloud_trace.log, gateway_trace.log and their rotated
+.1, .2, ... backups) and run:
+
+    python trace_report.py client_trace.log cloud_trace.log gateway_trace.log
+
+Each stage is reported as the time since its causal parent (PARENT), not
+since whichever span happened to be written last: the gateway and the
+cloud's reply to the client run concurrently, so wall-clock neighbours
+are often unrelated. Spans are stamped with each host's wall clock, so
+keep the hosts NTP-synchronised when they are not the same machine.
+"""
+import argparse
+import json
+import os
+import statistics
+from collections import defaultdict
+
+# Stage -> the stages that cause it, most direct first; the first one present
+# in a trace is the parent. Stages are reported in this order.
+PARENT = {
+    "client.sent": ("client.clicked",),
+    "cloud.received": ("client.sent",),
+    "cloud.esp_sent": ("cloud.received",),
+    "gateway.received": ("cloud.esp_sent",),
+    "gateway.serial_written": ("gateway.received",),
+    "gateway.serial_reply": ("gateway.serial_written",),
+    "cloud.ack": ("gateway.serial_reply", "cloud.esp_sent"),
+    "cloud.responded": ("cloud.esp_sent",),
+    "client.response": ("cloud.responded",),
+    "client.ui_updated": ("client.response",),
+}
+
+
+def read_spans(paths):
+    """Load spans from span files and their rotated backups, grouped by trace id"""
+    traces = defaultdict(list)
+    for path in paths:
+        backups = [f"{path}.{n}" for n in range(1, 100) if os.path.exists(f"{path}.{n}")]
+        for name in [path] + backups:
+            if not os.path.exists(name):
+                continue
+            with open(name) as f:
+                for line in f:
+                    try:
+                        span = json.loads(line)
+                    except ValueError:
+                        continue
+                    traces[span["trace"]].append(span)
+    return traces
+
+
+def stage_latencies(traces):
+    """Return {stage: [ms since its parent stage]} and the list of total trace durations"""
+    steps = defaultdict(list)
+    totals = []
+    for spans in traces.values():
+        # A stage recorded twice (e.g. a retried command) counts from its first span
+        first = {}
+        for span in sorted(spans, key=lambda span: span["ts"]):
+            first.setdefault(span["stage"], span["ts"])
+        for stage, parents in PARENT.items():
+            if stage not in first:
+                continue
+            parent = next((parent for parent in parents if parent in first), None)
+            if parent is not None:
+                steps[stage].append((first[stage] - first[parent]) * 1000)
+        totals.append((max(first.values()) - min(first.values())) * 1000)
+    return steps, totals
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="span files written by the IOTIFY components")
+    args = parser.parse_args()
+
+    traces = read_spans(args.files)
+    if not traces:
+        print("No spans found")
+        return
+
+    steps, totals = stage_latencies(traces)
+    stages = [stage for stage in PARENT if stage in steps]
+
+    print(f"{len(traces)} traces")
+    print(f"{'stage':<26}{'count':>7}{'median ms':>12}{'p95 ms':>10}{'max ms':>10}")
+    for stage in stages:
+        values = steps[stage]
+        print(f"{stage:<26}{len(values):>7}{statistics.median(values):>12.1f}"
+              f"{percentile(values, 0.95):>10.1f}{max(values):>10.1f}")
+    print(f"{'total':<26}{len(totals):>7}{statistics.median(totals):>12.1f}"
+          f"{percentile(totals, 0.95):>10.1f}{max(totals):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
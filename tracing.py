@@ -0,0 +1,47 @@
+import json
+import logging
+import logging.handlers
+import os
+import random
+import secrets
+import time
+
+# Fraction of control commands that carry a trace id
+TRACE_SAMPLE_RATE = float(os.environ.get("IOTIFY_TRACE_SAMPLE", "0.1"))
+TRACE_DIR = os.environ.get("IOTIFY_TRACE_DIR", ".")
+TRACE_MAX_BYTES = 1024 * 1024
+TRACE_BACKUPS = 3
+
+
+def new_trace_id():
+    """Return a fresh trace id for a sampled command, or None if not sampled"""
+    if random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    return secrets.token_hex(4)
+
+
+class SpanRecorder:
+    """Writes timestamped spans of traced commands to a local rotating file"""
+
+    def __init__(self, source, path=None):
+        self.source = source
+        self.path = path or os.path.join(TRACE_DIR, f"{source}_trace.log")
+
+        # A dedicated logger so spans never end up in the application log
+        self._logger = logging.getLogger(f"iotify.trace.{source}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, delay=True
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def record(self, trace_id, stage, **fields):
+        """Record that a traced command reached a stage (untraced commands are ignored)"""
+        if not trace_id:
+            return
+        span = {"trace": trace_id, "stage": stage, "ts": time.time(), "source": self.source}
+        span.update(fields)
+        self._logger.info(json.dumps(span))